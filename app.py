@@ -5,16 +5,24 @@ st.set_page_config(
     layout="wide"
 )
 
+import json
+import re
 import pandas as pd
 import numpy as np
-import altair as alt
-import folium
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import sqlite3
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from supabase import create_client, Client
-import cohere  # For generating advice
-from streamlit_folium import folium_static
+
+try:
+    import orjson  # Faster JSON decoding for large OSRM responses
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 
 # ============================
 # API KEYS and CONFIGURATION
@@ -27,15 +35,96 @@ SUPABASE_URL = SUPABASE_CONFIG.get("url")
 SUPABASE_ANON_KEY = SUPABASE_CONFIG.get("anon_key")
 SUPABASE_TABLE = SUPABASE_CONFIG.get("table_name")
 
-# Initialize Supabase Client (used for feedback)
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
+def _has_valid_key(key, placeholder=None):
+    """True when a configured key is set and is not the template placeholder."""
+    return bool(key) and key != placeholder
+
+# Supabase client (used for feedback), created once per process
+@st.cache_resource
+def _get_supabase(url, anon_key):
+    # Keyed on the credentials so a rotated key gets a fresh client.
+    # Deferred import: supabase pulls in httpx/gotrue/postgrest, only needed for feedback
+    from supabase import create_client
+    return create_client(url, anon_key)
+
+# Shared HTTP session so Nominatim/OSRM/NewsAPI calls reuse keep-alive connections
+HTTP_TIMEOUT = (3, 10)  # (connect, read) seconds
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+OSRM_ROUTE_URL = "https://router.project-osrm.org/route/v1/driving/"
+NEWS_API_URL = "https://newsapi.org/v2/everything"
+
+@st.cache_resource
+def _get_http_session() -> requests.Session:
+    session = requests.Session()
+    # All upstreams speak JSON. Accept-Encoding is left to requests, which already
+    # asks for gzip/deflate (and br/zstd when those decoders are installed)
+    session.headers.update({
+        'User-Agent': 'GreenRoute/1.0',
+        'Accept': 'application/json',
+    })
+    # One pool per upstream host (Nominatim, OSRM, NewsAPI); retry idempotent GETs on
+    # throttling/transient errors, then hand back the last response so callers can
+    # still act on its status
+    retry = Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # Nominatim gets its own adapter without status or read retries: they would resend
+    # to the server behind _wait_for_nominatim_slot's back and break its 1 req/s policy.
+    # A 429/5xx goes straight back to _geocode instead; only connection errors, which
+    # never reached the server, are retried.
+    nominatim_retry = retry.new(read=0, status=0, status_forcelist=[])
+    session.mount(NOMINATIM_URL, HTTPAdapter(max_retries=nominatim_retry))
+    return session
+
+SESSION = _get_http_session()
+
+# Nominatim usage policy allows at most one request per second per application
+NOMINATIM_MIN_INTERVAL = 1.0
+
+@st.cache_resource
+def _get_nominatim_throttle() -> dict:
+    # Shared across sessions and reruns so every caller respects the same budget
+    return {"lock": threading.Lock(), "last_call": 0.0}
+
+def _wait_for_nominatim_slot():
+    """Block until at least NOMINATIM_MIN_INTERVAL has passed since the last Nominatim call."""
+    throttle = _get_nominatim_throttle()
+    with throttle["lock"]:
+        wait = NOMINATIM_MIN_INTERVAL - (time.monotonic() - throttle["last_call"])
+        if wait > 0:
+            time.sleep(wait)
+        throttle["last_call"] = time.monotonic()
+
+# Background workers for non-critical jobs (feedback inserts, cache prefetches)
+@st.cache_resource
+def _get_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=2)
 
 # ============================
 # SQLite Database Setup for Sustainability Metrics
 # ============================
+@st.cache_resource
+def get_conn() -> sqlite3.Connection:
+    """
+    Shared autocommit SQLite connection, opened once per process.
+    WAL + synchronous=NORMAL avoids an fsync stall on every metrics update.
+    """
+    conn = sqlite3.connect("metrics.db", check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+@st.cache_resource
 def init_db():
-    conn = sqlite3.connect("metrics.db", check_same_thread=False)
-    c = conn.cursor()
+    """Create tables and seed the metrics row; runs once per process, not per rerun."""
+    c = get_conn().cursor()
     # Create table if it doesn't exist (fuel savings removed)
     c.execute("""
         CREATE TABLE IF NOT EXISTS sustainability_metrics (
@@ -49,19 +138,33 @@ def init_db():
     if c.fetchone() is None:
         c.execute("INSERT INTO sustainability_metrics (total_distance, total_emissions_saved) VALUES (?, ?)",
                   (0.0, 0.0))
-        conn.commit()
-    conn.close()
+    # Persistent NewsAPI responses, so restarts don't re-spend the API quota
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS news_cache (
+            query TEXT PRIMARY KEY,
+            fetched_at REAL,
+            articles TEXT
+        )
+    """)
+    # Persistent Nominatim results; its usage policy asks clients to cache lookups
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS geocode_cache (
+            address TEXT PRIMARY KEY,
+            fetched_at REAL,
+            lat REAL,
+            lon REAL
+        )
+    """)
 
 init_db()
 
-@st.cache_data
+# Local updates clear this cache; the TTL picks up writes from other processes
+@st.cache_data(ttl=60)
 def get_metrics_from_db():
     """Retrieve sustainability metrics from SQLite and return as a dict."""
-    conn = sqlite3.connect("metrics.db", check_same_thread=False)
-    c = conn.cursor()
+    c = get_conn().cursor()
     c.execute("SELECT total_distance, total_emissions_saved FROM sustainability_metrics LIMIT 1")
     row = c.fetchone()
-    conn.close()
     if row is None:
         return {"total_distance": 0.0, "total_emissions_saved": 0.0}
     return {"total_distance": row[0], "total_emissions_saved": row[1]}
@@ -71,148 +174,418 @@ def update_metrics_in_db(new_distance: float, new_emissions: float):
     Update the sustainability metrics in the SQLite DB.
     new_distance: distance in kilometers
     new_emissions: emissions saved in kg CO₂
+    Returns the updated totals as a dict, like get_metrics_from_db.
     """
-    conn = sqlite3.connect("metrics.db", check_same_thread=False)
-    c = conn.cursor()
-    c.execute("SELECT total_distance, total_emissions_saved FROM sustainability_metrics LIMIT 1")
+    c = get_conn().cursor()
+    # Single atomic upsert: no read-modify-write race between concurrent sessions.
+    # RETURNING hands back the new totals so callers need no follow-up SELECT.
+    c.execute("""
+        INSERT INTO sustainability_metrics (id, total_distance, total_emissions_saved)
+        VALUES (1, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET
+            total_distance = total_distance + excluded.total_distance,
+            total_emissions_saved = total_emissions_saved + excluded.total_emissions_saved
+        RETURNING total_distance, total_emissions_saved
+    """, (new_distance, new_emissions))
     row = c.fetchone()
-    if row is None:
-        current_distance, current_emissions = 0.0, 0.0
-    else:
-        current_distance, current_emissions = row
-    new_total_distance = current_distance + new_distance
-    new_total_emissions = current_emissions + new_emissions
-    c.execute("UPDATE sustainability_metrics SET total_distance = ?, total_emissions_saved = ? WHERE id = 1", 
-              (new_total_distance, new_total_emissions))
-    conn.commit()
-    conn.close()
-    get_metrics_from_db.clear()  # Clear cache so updated values are returned
+    get_metrics_from_db.clear()  # Clear cache so other pages see the updated values
+    return {"total_distance": row[0], "total_emissions_saved": row[1]}
 
 def get_sustainability_metrics():
     """Return the current sustainability metrics from SQLite."""
     return get_metrics_from_db()
 
+@st.cache_data
+def get_metrics_df(total_distance: float, total_emissions_saved: float, avg_emissions_saved: float):
+    """Build the Sustainability Metrics chart DataFrame; cached on the metric values."""
+    # Categorical labels are dictionary-encoded in the Arrow payload Streamlit ships
+    return pd.DataFrame({
+        "Metric": pd.Categorical([
+            "Total Kilometers Simulated",
+            "Total Emissions Saved (kg)",
+            "Avg Emissions per km (kg/km)"
+        ]),
+        "Value": np.array([
+            total_distance,
+            total_emissions_saved,
+            avg_emissions_saved
+        ], dtype=np.float32)
+    })
+
 # ============================
 # Cohere Advice Function
 # ============================
+@st.cache_resource
+def _get_cohere(api_key):
+    """Cohere client, created once per API key so its HTTP pool is reused."""
+    import cohere  # Deferred: only needed once advice is requested
+    return cohere.Client(api_key)
+
+def _advice_chunks(goal: str):
+    """Yield advice text from Cohere as tokens arrive."""
+    prompt = f"Provide practical, actionable advice on how to improve sustainability and reduce emissions with a focus on {goal}."
+    stream = _get_cohere(COHERE_API_KEY).generate_stream(
+         model="command-xlarge-nightly",
+         prompt=prompt,
+         max_tokens=400,  # Latency scales with generated tokens; 400 covers a full answer
+         temperature=0.7,
+         k=0,
+         p=0.75,
+         frequency_penalty=0,
+         presence_penalty=0,
+         stop_sequences=["--"]
+    )
+    for event in stream:
+        if event.event_type == "text-generation":
+            yield event.text
+        elif event.event_type == "stream-error":
+            raise RuntimeError(event.err)
+
+@st.cache_data(ttl=60*60, max_entries=512, show_spinner=False)
+def _generate_advice(goal: str) -> str:
+    """
+    Stream Cohere advice for a normalized goal into the page and return the full text.
+    On cache hits Streamlit replays the rendered text without calling Cohere.
+    Exceptions propagate so that failed generations are not cached.
+    """
+    return st.write_stream(_advice_chunks(goal)).strip()
+
 def get_cohere_advice(goal: str) -> str:
     """
     Generate actionable sustainability advice using Cohere API based on the user's sustainability goal.
+    The advice is rendered progressively as it streams in.
     If an error occurs, display an error message and return a default string.
     """
-    try:
-        co = cohere.Client(COHERE_API_KEY)
-        prompt = f"Provide practical, actionable advice on how to improve sustainability and reduce emissions with a focus on {goal}."
-        response = co.generate(
-             model="command-xlarge-nightly",
-             prompt=prompt,
-             max_tokens=6000,
-             temperature=0.7,
-             k=0,
-             p=0.75,
-             frequency_penalty=0,
-             presence_penalty=0,
-             stop_sequences=["--"]
-        )
-        advice = response.generations[0].text.strip()
+    if not _has_valid_key(COHERE_API_KEY, "YOUR_COHERE_API_KEY"):
+        # Fail fast instead of waiting on an authentication error from the API
+        st.warning("Cohere API key not configured.")
+        advice = "No advice available at this time."
+        st.info(advice)
         return advice
+    # Normalize case/whitespace so repeat goals hit the cache
+    normalized = " ".join(goal.lower().split())
+    try:
+        return _generate_advice(normalized)
     except Exception as e:
         st.error("Error generating advice. Please check your Cohere API key. " + str(e))
-        return "No advice available at this time."
+        advice = "No advice available at this time."
+        st.info(advice)
+        return advice
 
 # ============================
 # API Integration Functions
 # ============================
-def get_coordinates(address):
-    """Geocode an address using the free Nominatim API."""
-    url = f"https://nominatim.openstreetmap.org/search?q={address}&format=json&limit=1"
-    response = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'})
+class GeocodingError(Exception):
+    """Raised when Nominatim returns no usable result for an address."""
+
+class GeocodingRateLimited(GeocodingError):
+    """Raised when Nominatim answers 429 Too Many Requests."""
+
+GEOCODE_TTL = 7*24*60*60  # seconds; places rarely move
+
+def _geocode_from_disk(address):
+    """Return a fresh (lat, lon) for a normalized address from geocode_cache, or None."""
+    row = get_conn().execute("SELECT fetched_at, lat, lon FROM geocode_cache WHERE address = ?", (address,)).fetchone()
+    if row is not None and time.time() - row[0] < GEOCODE_TTL:
+        return row[1], row[2]
+    return None
+
+@st.cache_data(ttl=GEOCODE_TTL, max_entries=1024, show_spinner=False)
+def _geocode(address):
+    """
+    Cached Nominatim lookup returning (lat, lon).
+    Checks the on-disk geocode_cache table before calling the API.
+    Raises GeocodingError on failure so that misses are not cached.
+    """
+    cached = _geocode_from_disk(address)
+    if cached is not None:
+        return cached
+    conn = get_conn()
+    params = {"q": address, "format": "json", "limit": 1}
+    _wait_for_nominatim_slot()
+    try:
+        response = SESSION.get(NOMINATIM_URL, params=params, timeout=HTTP_TIMEOUT)
+    except requests.RequestException as e:
+        raise GeocodingError(address) from e
+    if response.status_code == 429:
+        raise GeocodingRateLimited(address)
     if response.status_code == 200:
-        data = response.json()
+        data = _json_loads(response.content)
         if data:
             lat = float(data[0]['lat'])
             lon = float(data[0]['lon'])
+            conn.execute("INSERT OR REPLACE INTO geocode_cache (address, fetched_at, lat, lon) VALUES (?, ?, ?, ?)",
+                         (address, time.time(), lat, lon))
             return lat, lon
+    raise GeocodingError(address)
+
+def _normalize_address(address):
+    # Normalize case/whitespace so variants of the same address share a cache entry
+    return " ".join(address.lower().split())
+
+def get_coordinates(address):
+    """Geocode an address using the free Nominatim API."""
+    try:
+        return _geocode(_normalize_address(address))
+    except GeocodingRateLimited:
+        st.warning("The geocoding service is rate limiting requests. Please wait a moment and try again.")
+    except GeocodingError:
+        pass
     return None, None
 
-def get_route_info(origin_coords, destination_coords):
+def _valid_coords(coords):
+    """True when a geocode result carries both a latitude and a longitude."""
+    return coords is not None and coords[0] is not None and coords[1] is not None
+
+def geocode_many(addresses):
     """
-    Retrieve route info using OSRM API.
-    Returns distance (in miles), duration (in hours), and route geometry as a GeoJSON LineString.
+    Geocode several addresses, preserving input order.
+    Each entry is (lat, lon), or (None, None) when it could not be geocoded.
+    Lookups run in a plain loop: the Nominatim throttle serializes uncached calls
+    anyway, and staying on the script thread lets rate-limit warnings reach the page.
+    """
+    return [get_coordinates(address) for address in addresses]
+
+def simplify_path(geometry, tolerance=0.001):
+    """
+    Ramer-Douglas-Peucker simplification of a [[lon, lat], ...] path.
+    Keeps both endpoints; tolerance is in degrees (~100 m at the default).
+    """
+    points = np.asarray(geometry, dtype=np.float64)
+    if len(points) < 3:
+        return geometry
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        seg = points[end] - points[start]
+        rel = points[start + 1:end] - points[start]
+        seg_len = np.hypot(seg[0], seg[1])
+        if seg_len == 0:
+            dists = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            # Perpendicular distance of each interior point to the start-end chord
+            dists = np.abs(seg[0] * rel[:, 1] - seg[1] * rel[:, 0]) / seg_len
+        idx = int(np.argmax(dists))
+        if dists[idx] > tolerance:
+            mid = start + 1 + idx
+            keep[mid] = True
+            stack.append((start, mid))
+            stack.append((mid, end))
+    return points[keep].tolist()
+
+MAX_PATH_POINTS = 1000
+
+def cap_path_points(geometry, max_points=MAX_PATH_POINTS):
+    """Stride-decimate a path to at most ~max_points vertices, always keeping the last one."""
+    if len(geometry) <= max_points:
+        return geometry
+    step = -(-len(geometry) // (max_points - 1))  # ceil division
+    capped = geometry[::step]
+    if capped[-1] != geometry[-1]:
+        capped.append(geometry[-1])
+    return capped
+
+def decode_polyline(encoded, precision=6):
+    """
+    Decode a Google-style encoded polyline into [lon, lat] pairs.
+    OSRM's polyline6 packs each vertex into a few bytes instead of a JSON float pair.
+    """
+    factor = 10 ** precision
+    coordinates = []
+    index = lat = lon = 0
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        coordinates.append([lon / factor, lat / factor])
+    return coordinates
+
+class RoutingError(Exception):
+    """Raised when OSRM returns no route between two coordinates."""
+
+@st.cache_data(ttl=60*60, max_entries=128, show_spinner=False)
+def _osrm_route(origin_coords, destination_coords):
+    """
+    Cached OSRM lookup returning (distance, duration, geometry).
+    Raises RoutingError on failure so that misses are not cached.
     """
     start_lon, start_lat = origin_coords[1], origin_coords[0]
     end_lon, end_lat = destination_coords[1], destination_coords[0]
-    url = (
-        f"http://router.project-osrm.org/route/v1/driving/"
-        f"{start_lon},{start_lat};{end_lon},{end_lat}"
-        f"?overview=full&geometries=geojson"
-    )
-    response = requests.get(url)
+    # OSRM takes coordinates as path segments, not query parameters
+    url = OSRM_ROUTE_URL + "{:.6f},{:.6f};{:.6f},{:.6f}".format(start_lon, start_lat, end_lon, end_lat)
+    # "simplified" lets OSRM generalize the polyline server-side
+    params = {"overview": "simplified", "geometries": "polyline6"}
+    try:
+        response = SESSION.get(url, params=params, timeout=HTTP_TIMEOUT)
+    except requests.RequestException as e:
+        raise RoutingError(origin_coords, destination_coords) from e
     if response.status_code == 200:
-        data = response.json()
+        data = _json_loads(response.content)
         if data and "routes" in data and len(data["routes"]) > 0:
             route = data["routes"][0]
             distance = route["distance"] / 1609.34  # convert meters to miles
             duration = route["duration"] / 3600.0     # convert seconds to hours
-            geometry = route.get("geometry", {}).get("coordinates", [])
+            try:
+                geometry = decode_polyline(route.get("geometry") or "")
+            except (IndexError, TypeError) as e:  # Truncated or malformed polyline
+                raise RoutingError(origin_coords, destination_coords) from e
             if not geometry or len(geometry) < 2:
                 geometry = [[start_lon, start_lat], [end_lon, end_lat]]
-            return distance, duration, geometry
-    return None, None, None
+            return distance, duration, cap_path_points(simplify_path(geometry))
+    raise RoutingError(origin_coords, destination_coords)
+
+def get_route_info(origin_coords, destination_coords):
+    """
+    Retrieve route info using OSRM API.
+    Returns distance (in miles), duration (in hours), and route geometry as a list of [lon, lat] pairs.
+    """
+    try:
+        # Rounded tuples give a stable cache key (6 decimals is ~11 cm)
+        return _osrm_route(
+            tuple(round(c, 6) for c in origin_coords),
+            tuple(round(c, 6) for c in destination_coords),
+        )
+    except RoutingError:
+        return None, None, None
+
+MILES_TO_KM = 1.60934
+
+# kg CO₂ emitted per mile, by vehicle type
+EMISSION_FACTORS = {
+    "car": 0.411,
+    "truck": 1.6,
+    "ev": 0.05,
+}
 
 def get_carbon_estimate(distance, vehicle_type='car'):
     """
     Estimate CO₂ emissions for a given distance (in miles).
     Example: a typical car emits ~0.411 kg CO₂ per mile.
+    Unknown vehicle types fall back to the car factor.
+    Accepts a scalar or an array of distances; arrays are multiplied in one vectorized pass.
     """
-    return distance * 0.411
+    factor = EMISSION_FACTORS.get(vehicle_type, EMISSION_FACTORS["car"])
+    if np.ndim(distance) == 0:
+        return distance * factor  # Stay a Python float so it can be bound into SQLite
+    return np.asarray(distance, dtype=np.float64) * factor
 
-def get_news_articles(query):
-    """Fetch news articles using NewsAPI."""
-    if not NEWS_API_KEY or NEWS_API_KEY == "YOUR_NEWS_API_KEY":
-        return []  # No API key provided
-    url = (
-        f"https://newsapi.org/v2/everything?q={query}&sortBy=publishedAt"
-        f"&apiKey={NEWS_API_KEY}&language=en&pageSize=5"
-    )
-    response = requests.get(url)
+class NewsFetchError(Exception):
+    """Raised when NewsAPI cannot be reached or returns an error status."""
+
+NEWS_TTL = 10*60  # seconds
+NEWS_QUERY = "sustainable logistics"
+
+def _news_from_disk(query):
+    """Return fresh articles for a query from news_cache, or None if missing or stale."""
+    row = get_conn().execute("SELECT fetched_at, articles FROM news_cache WHERE query = ?", (query,)).fetchone()
+    if row is not None and time.time() - row[0] < NEWS_TTL:
+        return _json_loads(row[1])
+    return None
+
+def _fetch_news(query):
+    """
+    NewsAPI lookup returning a list of article dicts, cached in the news_cache table.
+    There is deliberately no st.cache_data layer on top: its TTL would start when the
+    row is loaded rather than at fetched_at, letting articles outlive NEWS_TTL.
+    Raises NewsFetchError on failure so that errors are not cached.
+    """
+    cached = _news_from_disk(query)
+    if cached is not None:
+        return cached
+    conn = get_conn()
+    params = {
+        "q": query,
+        "sortBy": "publishedAt",
+        "apiKey": NEWS_API_KEY,
+        "language": "en",
+        "pageSize": 5,
+    }
+    try:
+        response = SESSION.get(NEWS_API_URL, params=params, timeout=HTTP_TIMEOUT)
+    except requests.RequestException as e:
+        raise NewsFetchError(query) from e
     if response.status_code == 200:
-        data = response.json()
+        data = _json_loads(response.content)
         articles = data.get("articles", [])
+        conn.execute("INSERT OR REPLACE INTO news_cache (query, fetched_at, articles) VALUES (?, ?, ?)",
+                     (query, time.time(), json.dumps(articles)))
         return articles
-    return []
+    raise NewsFetchError(query)
+
+def clear_news_cache():
+    """Drop cached news so the next fetch hits NewsAPI."""
+    get_conn().execute("DELETE FROM news_cache")
+
+def get_news_articles(query):
+    """Fetch news articles using NewsAPI."""
+    if not _has_valid_key(NEWS_API_KEY, "YOUR_NEWS_API_KEY"):
+        return []  # No API key provided
+    try:
+        return _fetch_news(query)
+    except NewsFetchError:
+        return []
+
+def prefetch_news(query):
+    """
+    Warm the news cache for a query.
+    Runs on a worker thread with no script context, so failures are dropped here
+    instead of being reported through st.* calls.
+    """
+    try:
+        _fetch_news(query)
+    except NewsFetchError:
+        pass
+
+# Basic shape check so malformed emails are rejected without a Supabase round trip
+_EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
 
 def save_feedback_to_supabase(name, email, feedback):
     """Save user feedback to Supabase."""
+    if not (_has_valid_key(SUPABASE_URL) and _has_valid_key(SUPABASE_ANON_KEY)):
+        return False  # Supabase not configured
     data = {
         "Name": name,
         "Email": email,
         "Feedback": feedback,
         "Timestamp": datetime.now().isoformat()
     }
-    response = supabase.table(SUPABASE_TABLE).insert(data).execute()
+    response = _get_supabase(SUPABASE_URL, SUPABASE_ANON_KEY).table(SUPABASE_TABLE).insert(data).execute()
     return response.data is not None
 
-# ============================
-# Page Configuration & Sidebar
-# ============================
-st.sidebar.title("Navigation")
-pages = [
-    "Overview", 
-    "Personalized Recommendations", 
-    "Educational Content",
-    "Sustainability Metrics",
-    "Route Optimization Simulator",
-    "Real-Time News",
-    "User Feedback",
-    "Sceptical?"
-]
-page = st.sidebar.radio("Go to", pages)
+def report_pending_feedback():
+    """Surface the outcome of a background feedback insert once it has finished."""
+    pending = st.session_state.get("_pending_feedback")
+    if pending is None or not pending.done():
+        return
+    del st.session_state["_pending_feedback"]
+    if pending.exception() is not None or not pending.result():
+        st.error("There was an error saving your last feedback. Please try again later.")
 
 # ============================
 # Overview Page
 # ============================
-if page == "Overview":
+HERO_IMAGE_WIDTH = 1200
+HERO_IMAGE_URL = (
+    "https://images.unsplash.com/photo-1504384308090-c894fdcc538d"
+    f"?w={HERO_IMAGE_WIDTH}&fm=webp&q=75"
+)
+
+def render_overview():
     st.title("GreenRoute: Revolutionizing Sustainable Logistics")
     st.markdown("""
     **Welcome to GreenRoute!**
@@ -220,14 +593,14 @@ if page == "Overview":
     Our platform leverages advanced AI, real-time data, and cutting-edge route optimization to help you make sustainable logistics decisions.
     Explore personalized recommendations, educational content, and an interactive route planner—all designed for today's logistics challenges.
     """)
-    st.image("https://images.unsplash.com/photo-1504384308090-c894fdcc538d",
-             caption="Sustainable Logistics in Action", use_column_width=True)
+    # Let Unsplash's CDN serve a resized WebP instead of the full-resolution JPEG
+    st.image(HERO_IMAGE_URL, caption="Sustainable Logistics in Action", width=HERO_IMAGE_WIDTH)
     st.markdown("### Use the sidebar to explore the features!")
 
 # ============================
 # Personalized Recommendations Page
 # ============================
-elif page == "Personalized Recommendations":
+def render_recommendations():
     st.title("Personalized Recommendations")
     st.markdown("""
     **Tailored Solutions for Your Sustainability Goals**
@@ -246,16 +619,16 @@ elif page == "Personalized Recommendations":
     with col2:
         if st.button("Get Advice"):
             if user_goal.strip():
-                advice = get_cohere_advice(user_goal.strip())
                 st.markdown("### Advice:")
-                st.info(advice)
+                with st.container(border=True):
+                    get_cohere_advice(user_goal.strip())  # Streams the advice into this box
             else:
                 st.warning("Please enter a sustainability goal.")
 
 # ============================
 # Educational Content Page
 # ============================
-elif page == "Educational Content":
+def render_educational_content():
     st.title("Educational Content")
     st.markdown("""
     ### Dive into Sustainable Logistics
@@ -276,45 +649,134 @@ elif page == "Educational Content":
 # ============================
 # Sustainability Metrics Page
 # ============================
-elif page == "Sustainability Metrics":
+# Static Vega-Lite spec built once; each rerun only supplies the data.
+# Avoids Altair's per-rerun validation/serialization.
+SUSTAINABILITY_CHART_SPEC = {
+    "mark": "bar",
+    "encoding": {
+        "x": {"field": "Metric", "type": "nominal", "sort": None},
+        "y": {"field": "Value", "type": "quantitative"},
+        "color": {"field": "Metric", "type": "nominal"}
+    },
+    "width": 700,
+    "height": 400
+}
+
+def render_sustainability_metrics():
     st.title("Sustainability Metrics")
     st.markdown("### Overall Impact of GreenRoute")
     
     metrics = get_sustainability_metrics()
     total_distance = metrics.get("total_distance", 0.0)
     total_emissions_saved = metrics.get("total_emissions_saved", 0.0)
-    
-    avg_emissions_saved = total_emissions_saved / total_distance if total_distance else 0
 
-    st.write(f"**Total Kilometers Simulated:** {total_distance:.2f} km")
-    st.write(f"**Total CO₂ Emissions Saved:** {total_emissions_saved:.2f} kg")
-    st.write(f"**Average Emissions Saved per Kilometer:** {avg_emissions_saved:.2f} kg/km")
+    # Nothing simulated yet: skip the table and chart, which would only show zeros
+    if not total_distance:
+        st.metric("Total Kilometers Simulated", "0.00 km")
+        st.info("Run a simulation on the 'Route Optimization Simulator' page to start populating metrics.")
+        return
     
-    metrics_df = pd.DataFrame({
-        "Metric": [
+    avg_emissions_saved = total_emissions_saved / total_distance
+
+    # One table element instead of a separate message per KPI
+    st.table(pd.DataFrame({
+        "KPI": [
             "Total Kilometers Simulated",
-            "Total Emissions Saved (kg)",
-            "Avg Emissions per km (kg/km)"
+            "Total CO₂ Emissions Saved",
+            "Average Emissions Saved per Kilometer"
         ],
         "Value": [
-            total_distance,
-            total_emissions_saved,
-            avg_emissions_saved
+            f"{total_distance:.2f} km",
+            f"{total_emissions_saved:.2f} kg",
+            f"{avg_emissions_saved:.2f} kg/km"
         ]
-    })
-    chart = alt.Chart(metrics_df).mark_bar().encode(
-        x=alt.X("Metric:N", sort=None),
-        y=alt.Y("Value:Q"),
-        color=alt.Color("Metric:N")
-    ).properties(width=700, height=400)
-    st.altair_chart(chart, use_container_width=True)
+    }).set_index("KPI"))
+    
+    metrics_df = get_metrics_df(total_distance, total_emissions_saved, avg_emissions_saved)
+    st.vega_lite_chart(metrics_df, SUSTAINABILITY_CHART_SPEC, width="stretch")
     
     st.info("GreenRoute has been instrumental in reducing emissions through optimized routing.")
 
 # ============================
 # Route Optimization Simulator Page
 # ============================
-elif page == "Route Optimization Simulator":
+MAP_WIDTH = 700   # px; conservative estimate of the main column width
+MAP_HEIGHT = 500  # px; height of the embedded map iframe
+MAX_MERCATOR_LAT = 85.051129  # Web Mercator is undefined beyond this latitude
+
+def _mercator_y(lat):
+    lat = np.radians(np.clip(lat, -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT))
+    return np.log(np.tan(np.pi / 4 + lat / 2))
+
+def fit_map_view(coords, width=MAP_WIDTH, height=MAP_HEIGHT, padding=0.8):
+    """
+    Return (lat, lon, zoom) so the bounding box of [lon, lat] coords fits the map.
+    At zoom z the Web Mercator world is 512 * 2**z px across, covering 360° of
+    longitude and 2π of projected latitude; padding leaves a margin around the route.
+    """
+    (min_lon, min_lat), (max_lon, max_lat) = coords.min(axis=0), coords.max(axis=0)
+    min_y, max_y = _mercator_y(min_lat), _mercator_y(max_lat)
+    lon_span = max(max_lon - min_lon, 1e-9)
+    y_span = max(max_y - min_y, 1e-9)
+    zoom_x = np.log2(width * padding * 360 / (512 * lon_span))
+    zoom_y = np.log2(height * padding * 2 * np.pi / (512 * y_span))
+    zoom = float(np.clip(min(zoom_x, zoom_y), 1, 15))
+    # Centre on the projected midpoint so the margins above and below match on screen
+    center_lat = float(np.degrees(2 * np.arctan(np.exp((min_y + max_y) / 2)) - np.pi / 2))
+    return center_lat, float((min_lon + max_lon) / 2), zoom
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def build_route_deck_html(geometry, origin_coords, destination_coords):
+    """
+    Build the route map as standalone deck.gl HTML.
+    geometry is a tuple of (lon, lat) pairs; origin/destination are (lat, lon).
+    """
+    import pydeck as pdk  # Deferred: only the simulator draws a map
+
+    # OSRM geometry is already [lon, lat], which is what deck.gl expects
+    coords = np.asarray(geometry, dtype=np.float64)
+    center_lat, center_lon, zoom = fit_map_view(coords)
+
+    # A single-row frame holding the whole path is drawn as one WebGL PathLayer
+    route_layer = pdk.Layer(
+        "PathLayer",
+        # 5 decimals (~1 m) is plenty for display and shrinks the deck JSON
+        data=pd.DataFrame({"path": [np.round(coords, 5).tolist()]}),
+        get_path="path",
+        get_color=[255, 0, 0],
+        width_min_pixels=3,
+    )
+    endpoint_layer = pdk.Layer(
+        "ScatterplotLayer",
+        data=pd.DataFrame({
+            "name": ["Origin", "Destination"],
+            "lon": [origin_coords[1], destination_coords[1]],
+            "lat": [origin_coords[0], destination_coords[0]],
+        }),
+        get_position=["lon", "lat"],
+        get_fill_color=[0, 128, 0],
+        radius_min_pixels=6,
+        pickable=True,
+    )
+    view_state = pdk.ViewState(latitude=center_lat, longitude=center_lon, zoom=zoom)
+    deck = pdk.Deck(
+        layers=[route_layer, endpoint_layer],
+        initial_view_state=view_state,
+        tooltip={"text": "{name}"},
+    )
+    return deck.to_html(as_string=True, notebook_display=False)
+
+DEFAULT_ORIGIN = "New York, NY"
+DEFAULT_DESTINATION = "Los Angeles, CA"
+
+def prefetch_route(origin_coords, destination_coords):
+    """
+    Warm the OSRM route cache for two already-geocoded endpoints.
+    Runs on a worker thread with no script context, so it must not call st.* elements.
+    """
+    get_route_info(origin_coords, destination_coords)
+
+def render_route_simulator():
     st.title("Route Optimization Simulator")
     st.markdown("""
     **Simulate Your Route and Visualize the Optimal Path**
@@ -322,71 +784,93 @@ elif page == "Route Optimization Simulator":
     Enter your origin and destination below to calculate the best route. Our system retrieves the route geometry via the OSRM API and displays it on an interactive map.
     """)
     
+    # Warm the default route in the background while the user reads the page.
+    # Only endpoints already in geocode_cache are used, so the prefetch never spends
+    # Nominatim's 1 req/s budget ahead of the user's own lookups.
+    if "prefetched_default_route" not in st.session_state:
+        st.session_state["prefetched_default_route"] = True
+        origin_coords = _geocode_from_disk(_normalize_address(DEFAULT_ORIGIN))
+        destination_coords = _geocode_from_disk(_normalize_address(DEFAULT_DESTINATION))
+        if origin_coords is not None and destination_coords is not None:
+            _get_executor().submit(prefetch_route, origin_coords, destination_coords)
+
     col1, col2 = st.columns(2)
     with col1:
-        origin = st.text_input("Enter Origin", "New York, NY")
+        origin = st.text_input("Enter Origin", DEFAULT_ORIGIN)
     with col2:
-        destination = st.text_input("Enter Destination", "Los Angeles, CA")
+        destination = st.text_input("Enter Destination", DEFAULT_DESTINATION)
     
+    route_key = (origin, destination)
+    metrics = None
     if st.button("Simulate Route"):
         if origin and destination:
-            origin_coords = get_coordinates(origin)  # (lat, lon)
-            destination_coords = get_coordinates(destination)  # (lat, lon)
-            if None in origin_coords or None in destination_coords:
-                st.error("Could not geocode the provided addresses. Please try different inputs.")
-            else:
-                result = get_route_info(origin_coords, destination_coords)
-                if result[0] is not None:
-                    distance, duration, geometry = result
-                    emissions_estimated = get_carbon_estimate(distance)
-                    st.success(f"Optimized route from **{origin}** to **{destination}**:")
-                    st.write(f"**Estimated Distance:** {distance:.2f} miles")
-                    st.write(f"**Estimated Travel Time:** {duration:.2f} hours")
-                    st.write(f"**Estimated CO₂ Emissions Saved:** {emissions_estimated:.2f} kg")
-                    
-                    # Convert distance from miles to kilometers and update metrics in SQLite
-                    km_distance = distance * 1.60934
-                    update_metrics_in_db(new_distance=km_distance, new_emissions=emissions_estimated)
-                    
-                    if not geometry or len(geometry) < 2:
-                        geometry = [[origin_coords[1], origin_coords[0]], [destination_coords[1], destination_coords[0]]]
-                    
-                    # Convert OSRM geometry ([lon, lat]) to Folium format ([lat, lon])
-                    folium_geometry = [[pt[1], pt[0]] for pt in geometry]
-                    
-                    center_lat = sum(pt[0] for pt in folium_geometry) / len(folium_geometry)
-                    center_lon = sum(pt[1] for pt in folium_geometry) / len(folium_geometry)
-                    
-                    m = folium.Map(location=[center_lat, center_lon], zoom_start=6)
-                    folium.PolyLine(locations=folium_geometry, color="red", weight=5).add_to(m)
-                    folium.Marker(location=[origin_coords[0], origin_coords[1]], popup="Origin").add_to(m)
-                    folium.Marker(location=[destination_coords[0], destination_coords[1]], popup="Destination").add_to(m)
-                    
-                    folium_static(m, width=700, height=500)
-                    
-                    # Display updated sustainability metrics immediately
-                    metrics = get_sustainability_metrics()
-                    st.markdown("### Updated Sustainability Impact")
-                    st.write(f"**Total Kilometers Simulated:** {metrics.get('total_distance', 0.0):.2f} km")
-                    st.write(f"**Total CO₂ Emissions Saved:** {metrics.get('total_emissions_saved', 0.0):.2f} kg")
-                    st.info("For a more detailed view, please check the 'Sustainability Metrics' page in the sidebar.")
+            last_route = st.session_state.get("last_route")
+            if last_route is None or last_route["key"] != route_key:
+                last_route = None
+                # Geocode both endpoints; each result is (lat, lon)
+                origin_coords, destination_coords = geocode_many([origin, destination])
+                if not (_valid_coords(origin_coords) and _valid_coords(destination_coords)):
+                    st.error("Could not geocode the provided addresses. Please try different inputs.")
                 else:
-                    st.error("Could not retrieve route information. Please try again later.")
+                    distance, duration, geometry = get_route_info(origin_coords, destination_coords)
+                    if distance is not None:
+                        if not geometry or len(geometry) < 2:
+                            geometry = [[origin_coords[1], origin_coords[0]], [destination_coords[1], destination_coords[0]]]
+                        # Keep the route and its derived view state so reruns skip recomputation
+                        last_route = {
+                            "key": route_key,
+                            "distance": distance,
+                            "duration": duration,
+                            "emissions": get_carbon_estimate(distance),
+                            "geometry": tuple(map(tuple, geometry)),
+                            "origin_coords": tuple(origin_coords),
+                            "destination_coords": tuple(destination_coords),
+                        }
+                        st.session_state["last_route"] = last_route
+                    else:
+                        st.error("Could not retrieve route information. Please try again later.")
+            if last_route is not None:
+                # Convert distance from miles to kilometers and update metrics in SQLite
+                km_distance = last_route["distance"] * MILES_TO_KM
+                metrics = update_metrics_in_db(new_distance=km_distance, new_emissions=last_route["emissions"])
         else:
             st.warning("Please enter both origin and destination.")
 
+    last_route = st.session_state.get("last_route")
+    if last_route is not None and last_route["key"] == route_key:
+        st.success(f"Optimized route from **{origin}** to **{destination}**:")
+        st.write(f"**Estimated Distance:** {last_route['distance']:.2f} miles")
+        st.write(f"**Estimated Travel Time:** {last_route['duration']:.2f} hours")
+        st.write(f"**Estimated CO₂ Emissions Saved:** {last_route['emissions']:.2f} kg")
+
+        # Hashable tuples so the rendered map is cached per route
+        deck_html = build_route_deck_html(
+            last_route["geometry"], last_route["origin_coords"], last_route["destination_coords"]
+        )
+        # Embed the standalone deck HTML rather than re-serializing via st.pydeck_chart
+        st.iframe(deck_html, height=MAP_HEIGHT)
+
+        # Display updated sustainability metrics immediately, reusing the totals from the write
+        if metrics is None:
+            metrics = get_sustainability_metrics()
+        st.markdown("### Updated Sustainability Impact")
+        st.write(f"**Total Kilometers Simulated:** {metrics.get('total_distance', 0.0):.2f} km")
+        st.write(f"**Total CO₂ Emissions Saved:** {metrics.get('total_emissions_saved', 0.0):.2f} kg")
+        st.info("For a more detailed view, please check the 'Sustainability Metrics' page in the sidebar.")
+
 # ============================
 # Real-Time News Page
 # ============================
-elif page == "Real-Time News":
+def render_news():
     st.title("Real-Time News")
     st.markdown("""
     **Stay Updated with the Latest in Sustainable Logistics**
 
     We fetch live news articles using NewsAPI to keep you informed about trends and innovations in the logistics industry.
     """)
-    query = "sustainable logistics"
-    articles = get_news_articles(query)
+    if st.button("Refresh news"):
+        clear_news_cache()
+    articles = get_news_articles(NEWS_QUERY)
     if articles:
         for article in articles:
             st.subheader(article.get("title", "No Title"))
@@ -399,7 +883,7 @@ elif page == "Real-Time News":
 # ============================
 # User Feedback Page
 # ============================
-elif page == "User Feedback":
+def render_feedback():
     st.title("User Feedback")
     st.markdown("""
     **We Value Your Input**
@@ -412,15 +896,21 @@ elif page == "User Feedback":
         feedback = st.text_area("Your Feedback", "Enter your feedback here...")
         submitted = st.form_submit_button("Submit Feedback")
         if submitted:
-            if name and email and feedback:
-                success = save_feedback_to_supabase(name, email, feedback)
-                if success:
-                    st.success("Thank you for your feedback! It has been successfully saved.")
-                else:
-                    st.error("There was an error saving your feedback. Please try again later.")
-            else:
+            if not (name and email and feedback):
                 st.warning("Please fill in all fields before submitting.")
-elif page == "Sceptical?":
+            elif not _EMAIL_RE.match(email.strip()):
+                st.warning("Please enter a valid email address.")
+            else:
+                # Insert in the background; failures are reported on the next rerun
+                st.session_state["_pending_feedback"] = _get_executor().submit(
+                    save_feedback_to_supabase, name, email, feedback
+                )
+                st.success("Thank you for your feedback! It is being saved.")
+
+# ============================
+# Sceptical? Page
+# ============================
+def render_sceptical():
     st.title("How this program works")
     text = (
         "The code calculates and updates its sustainability metrics by storing and aggregating values in a local SQLite database. "
@@ -430,10 +920,39 @@ elif page == "Sceptical?":
         "When a user simulates a route using the Route Optimization Simulator page, the code first calls an external API (OSRM) to obtain route information. This API returns the route’s distance (in miles), duration (in hours), and the route geometry. "
         "The distance is then used in two calculations. First, it is converted from miles to kilometers (by multiplying by 1.60934) so that it matches the unit used in the database. "
         "Second, the function get_carbon_estimate estimates the CO₂ emissions saved by multiplying the distance in miles by a constant factor (0.411 kg CO₂ per mile). "
-        "The update_metrics_in_db function reads the current metric values from the database and then updates them by adding the new route’s data. "
+        "The update_metrics_in_db function then adds the new route’s data to the stored totals in a single SQL statement, so concurrent simulations never overwrite each other. "
         "The new total distance becomes the previous distance plus the newly simulated distance (in kilometers), and the new total emissions saved is the previous value plus the estimated CO₂ saved from the current route. "
         "After updating, the new values are written back to the database and the cache is cleared to ensure that the updated metrics are displayed. "
         "On the Sustainability Metrics page, the dashboard displays the cumulative total kilometers simulated and total CO₂ emissions saved. "
-        "These values are then visualized using a bar chart generated with Altair."
+        "These values are then visualized as a bar chart rendered from a fixed Vega-Lite specification."
     )
     st.write(text)
+
+# ============================
+# Page Configuration & Sidebar
+# ============================
+# Page title -> render function; only the selected page's body runs per rerun
+PAGES = {
+    "Overview": render_overview,
+    "Personalized Recommendations": render_recommendations,
+    "Educational Content": render_educational_content,
+    "Sustainability Metrics": render_sustainability_metrics,
+    "Route Optimization Simulator": render_route_simulator,
+    "Real-Time News": render_news,
+    "User Feedback": render_feedback,
+    "Sceptical?": render_sceptical,
+}
+
+# `streamlit run` executes this file as __main__; skip rendering if imported
+if __name__ == "__main__":
+    st.sidebar.title("Navigation")
+    page = st.sidebar.radio("Go to", list(PAGES))
+    report_pending_feedback()
+    # Warm the news cache in the background on a session's first load, but only
+    # when the on-disk copy is stale; a fresh one is already a cheap local read
+    if "prefetched_news" not in st.session_state:
+        st.session_state["prefetched_news"] = True
+        if (page != "Real-Time News" and _has_valid_key(NEWS_API_KEY, "YOUR_NEWS_API_KEY")
+                and _news_from_disk(NEWS_QUERY) is None):
+            _get_executor().submit(prefetch_news, NEWS_QUERY)
+    PAGES[page]()